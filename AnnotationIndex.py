@@ -0,0 +1,221 @@
+import argparse
+import os
+
+import obonet
+
+from Utils import iter_bioc_documents, json_dumps, json_loads
+
+# relations followed when computing the ancestor closure of a term
+HIERARCHY_RELATIONS = ("is_a", "part_of")
+
+
+def get_ancestor_closure(ontology, relations=HIERARCHY_RELATIONS):
+    """
+    Compute the transitive ancestors of every term in the ontology.
+    @param ontology: networkx graph as returned by obonet (edges point from child to parent)
+    @param relations: edge keys (relationship types) to follow
+    @return: dict mapping each term ID to the set of its ancestor term IDs
+    """
+    parents = {node: set() for node in ontology.nodes}
+    for child, parent, key in ontology.edges(keys=True):
+        if key in relations:
+            parents[child].add(parent)
+    closure = {}
+
+    def visit(node, in_progress):
+        if node in closure:
+            return closure[node]
+        in_progress.add(node)
+        ancestors = set()
+        for parent in parents.get(node, ()):
+            ancestors.add(parent)
+            if parent not in in_progress:
+                ancestors |= visit(parent, in_progress)
+        in_progress.discard(node)
+        closure[node] = ancestors
+        return ancestors
+
+    for node in parents:
+        visit(node, set())
+    return closure
+
+
+class AnnotationIndex:
+    """
+    Inverted index of ontology annotations (term ID -> document/passage/offset postings) across an
+    annotated corpus. The index is stored as a single JSON file and updated incrementally.
+    """
+
+    def __init__(self, index_path, ontology_paths=None):
+        self.index_path = index_path
+        self.ontology_paths = [ontology_paths] if isinstance(ontology_paths, str) else ontology_paths
+        self.closure = None
+        # postings[term_id][doc_id] = [[passage, offset, length], ...]
+        self.postings = {}
+        # ancestors[term_id] = [ancestor term IDs], stored for indexed terms only
+        self.ancestors = {}
+        # files[path] = {"mtime": float, "documents": [doc IDs]}
+        self.files = {}
+        # doc_terms[doc_id] = [term IDs], so a document can be removed without scanning all postings
+        self.doc_terms = {}
+        if os.path.exists(index_path):
+            self.load()
+
+    def load(self):
+        with open(self.index_path, "rb") as f:
+            data = json_loads(f.read())
+        self.postings = data.get("postings", {})
+        self.ancestors = data.get("ancestors", {})
+        self.files = data.get("files", {})
+        self.doc_terms = data.get("doc_terms", {})
+        if not self.doc_terms and self.postings:
+            # index written before doc_terms was stored
+            for term_id, postings in self.postings.items():
+                for doc_id in postings:
+                    self.doc_terms.setdefault(doc_id, []).append(term_id)
+
+    def save(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json_dumps({
+                "postings": self.postings,
+                "ancestors": self.ancestors,
+                "files": self.files,
+                "doc_terms": self.doc_terms
+            }))
+        os.replace(tmp_path, self.index_path)
+
+    def __get_ancestors(self, term_id):
+        if term_id in self.ancestors:
+            return self.ancestors[term_id]
+        if not self.ontology_paths:
+            # an empty ancestor list would be stored and never recomputed
+            raise ValueError(F"Ontology required to index new term: {term_id}")
+        if self.closure is None:
+            # parsing the OBO file is expensive, only do it once new terms show up
+            self.closure = {}
+            for ontology_path in self.ontology_paths or []:
+                for node, ancestors in get_ancestor_closure(obonet.read_obo(ontology_path)).items():
+                    self.closure.setdefault(node, set()).update(ancestors)
+        ancestors = sorted(self.closure.get(term_id, ()))
+        self.ancestors[term_id] = ancestors
+        return ancestors
+
+    def remove_document(self, doc_id):
+        for term_id in self.doc_terms.pop(doc_id, []):
+            self.postings[term_id].pop(doc_id, None)
+            if not self.postings[term_id]:
+                del self.postings[term_id]
+                self.ancestors.pop(term_id, None)
+
+    def add_document(self, doc):
+        """
+        Add the annotations of a BioC document to the index, replacing earlier postings of the document.
+        @param doc: BioC document (dict) with annotated passages
+        @return: ID of the indexed document
+        """
+        self.remove_document(str(doc["id"]))
+        return self.__index_document(doc)
+
+    def __index_document(self, doc):
+        doc_id = str(doc["id"])
+        terms = set()
+        for idx_psg, passage in enumerate(doc["passages"]):
+            for annotation in passage.get("annotations", []):
+                term_id = annotation["infons"].get("x-ref")
+                if not term_id:
+                    continue
+                self.__get_ancestors(term_id)
+                terms.add(term_id)
+                postings = self.postings.setdefault(term_id, {}).setdefault(doc_id, [])
+                postings += [[idx_psg, loc["offset"], loc["length"]] for loc in annotation["locations"]]
+        self.doc_terms[doc_id] = sorted(terms)
+        return doc_id
+
+    def add_file(self, filepath):
+        """
+        Index an annotated BioC file (.ann.json), i.e. a single document or a collection.
+        Postings of documents from an earlier version of the file are replaced.
+        @param filepath: path to the annotated BioC file
+        """
+        key = os.path.abspath(filepath)
+        for doc_id in self.files.get(key, {}).get("documents", []):
+            self.remove_document(doc_id)
+        doc_ids = []
+        for doc in iter_bioc_documents(filepath):
+            # documents not indexed from this file before may still be indexed from another file
+            if str(doc["id"]) in self.doc_terms:
+                self.remove_document(str(doc["id"]))
+            doc_ids.append(self.__index_document(doc))
+        self.files[key] = {
+            "mtime": os.path.getmtime(filepath),
+            "documents": doc_ids
+        }
+
+    def update(self, directory):
+        """
+        Index annotated files in a directory (recursively) that are new or changed since the last update.
+        @param directory: root directory of the annotated corpus
+        @return: number of (re-)indexed files
+        """
+        n_indexed = 0
+        for root, _, files in os.walk(directory):
+            for fn in files:
+                if not fn.endswith(".ann.json"):
+                    continue
+                filepath = os.path.join(root, fn)
+                entry = self.files.get(os.path.abspath(filepath))
+                if entry and entry["mtime"] >= os.path.getmtime(filepath):
+                    continue
+                self.add_file(filepath)
+                n_indexed += 1
+        return n_indexed
+
+    def get_subterms(self, term_id):
+        """
+        Return all indexed terms that are the given term or fall below it (is_a/part_of) in the hierarchy.
+        """
+        return [t for t, ancestors in self.ancestors.items() if t == term_id or term_id in ancestors]
+
+    def search(self, term_id, include_subterms=True):
+        """
+        Look up all annotations of an ontology term.
+        @param term_id: ontology term ID (e.g. UBERON:0002107)
+        @param include_subterms: also return annotations of terms below term_id in the hierarchy
+        @return: list of (doc_id, term_id, passage, offset, length) tuples
+        """
+        terms = self.get_subterms(term_id) if include_subterms else [term_id]
+        if term_id not in terms:
+            terms.append(term_id)
+        return [(doc_id, t, idx_psg, offset, length)
+                for t in terms
+                for doc_id, postings in self.postings.get(t, {}).items()
+                for idx_psg, offset, length in postings]
+
+    def get_documents(self, term_id, include_subterms=True):
+        """
+        Return IDs of documents mentioning an ontology term (or any of its subterms).
+        """
+        return sorted({x[0] for x in self.search(term_id, include_subterms)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-i', '--index', type=str, required=True, help="Path to the index file")
+    parser.add_argument('-d', '--directory', type=str, help="Directory containing annotated BioC files to index")
+    parser.add_argument('-o', '--ontology', type=str, nargs='+', help="Path(s) to ontology OBO files")
+    parser.add_argument('-q', '--query', type=str, help="Ontology term ID to search for")
+    parser.add_argument('--exact', action='store_true', help="Do not include subterms in the search")
+    args = parser.parse_args()
+    if args.directory and not args.ontology:
+        parser.error("-o/--ontology is required when indexing a directory (-d)")
+    index = AnnotationIndex(args.index, args.ontology)
+    if args.directory:
+        print(F"Indexed {index.update(args.directory)} file(s)")
+        index.save()
+    if args.query:
+        for hit in index.search(args.query, not args.exact):
+            print("\t".join(str(x) for x in hit))
@@ -9,13 +9,16 @@ import obonet
 import networkx
 import uuid
 import os
+from contextlib import nullcontext
 from spacy.matcher import PhraseMatcher
 from spacy.tokens import Span
 
 # from single_cell_use_case.OntologyAnnotator.Abbreviation import replace_all_abbreviations
 # from single_cell_use_case.OntologyAnnotator.Utils import load_bioc_study
 from Abbreviation import get_all_abbreviations
-from Utils import load_bioc_study, write_bioc_study
+from Utils import iter_bioc_documents, write_bioc_documents
+from AnnotationIndex import AnnotationIndex
+from ColumnarExport import DEFAULT_BATCH_ROWS, AnnotationExporter
 import difflib
 
 
@@ -28,33 +31,111 @@ def sort_strings_by_similarity(input_str, string_list):
     return list(zip(string_list, scores))[0]
 
 
+def split_text(text, max_size, overlap=0):
+    """
+    Split text into chunks of at most max_size characters, aligned to sentence or whitespace boundaries.
+    Consecutive chunks overlap by (roughly) the given number of characters. The overlap starts at a
+    token boundary where possible; if the overlap window contains no whitespace, it starts mid-token.
+    @param text: text to split
+    @param max_size: maximum chunk size in characters
+    @param overlap: number of characters shared between consecutive chunks
+    @return: list of (start, end) character offsets of the chunks
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + max_size
+        if end >= len(text):
+            chunks.append((start, len(text)))
+            break
+        # prefer the last sentence boundary in the second half of the chunk, then whitespace
+        window = text[start + max_size // 2:end]
+        boundary = max(window.rfind(". "), window.rfind("\n"), window.rfind("\t"))
+        if boundary == -1:
+            boundary = max(window.rfind(" "), window.rfind("\t"))
+        if boundary != -1:
+            end = start + max_size // 2 + boundary + 1
+        chunks.append((start, end))
+        next_start = max(end - overlap, start + 1)
+        # move start of the next chunk forward to a token boundary
+        aligned_start = next_start
+        while overlap and aligned_start < end and not text[aligned_start - 1].isspace():
+            aligned_start += 1
+        # no token boundary within the overlap: keep a character-aligned overlap
+        start = aligned_start if aligned_start < end else next_start
+    return chunks
+
+
+def merge_entities(entities, rank=None):
+    """
+    Merge entities found in overlapping chunks: drop duplicates and keep the longest of overlapping matches.
+    @param entities: list of (text, label, start_char, end_char) tuples
+    @param rank: optional function mapping a label to its priority (lower wins before length is compared)
+    @return: sorted list of non-overlapping entities
+    """
+    rank = rank if rank else lambda label: 0
+    merged = []
+    for ent in sorted(set(entities), key=lambda x: (x[2], x[2] - x[3])):
+        if merged and ent[2] < merged[-1][3]:
+            prev = merged[-1]
+            if (rank(ent[1]), ent[2] - ent[3]) < (rank(prev[1]), prev[2] - prev[3]):
+                merged[-1] = ent
+            continue
+        merged.append(ent)
+    return merged
+
+
 class SpacyModel:
 
-    def __init__(self, ontology_path):
+    def __init__(self, ontology_paths, max_chunk_size=100000, chunk_overlap=500, priorities=None):
+        """
+        @param ontology_paths: path (or list of paths) to ontology OBO files, matched in a single pass
+        @param max_chunk_size: size budget, passages longer than this (characters) are annotated in chunks
+        @param chunk_overlap: number of characters shared between consecutive chunks
+        @param priorities: dict mapping ontology names to ranks (lower wins on overlapping matches),
+                           defaults to the order of ontology_paths
+        """
         # pip install https://s3-us-west-2.amazonaws.com/ai2-s2-scispacy/releases/v0.5.3/en_ner_bionlp13cg_md-0.5.3.tar.gz
         self.model = spacy.load("en_ner_bionlp13cg_md", disable=["ner"])
-        self.ontology = obonet.read_obo(ontology_path)  # ("/home/tr142/Downloads/uberon.obo")
-        self.term_list = self.get_simple_term_list()
-        # self.ontology = obonet.read_obo("/home/hdetering/Dropbox/Projects/Bgee/visualisation/data/uberon.obo")
+        # size budget: passages longer than max_chunk_size characters are annotated in chunks
+        self.max_chunk_size = max_chunk_size
+        self.chunk_overlap = min(chunk_overlap, max_chunk_size // 2)
+        self.model.max_length = max(self.model.max_length, max_chunk_size)
+        if isinstance(ontology_paths, str):
+            ontology_paths = [ontology_paths]
+        # term ID -> name of the ontology it is taken from (terms imported by several ontologies are added once)
+        self.term_ontology = {}
+        self.term_list = {}
+        self.ontology_names = []
         self.term_matcher = PhraseMatcher(self.model.vocab, attr="LOWER")
         self.abbreviation_matcher = PhraseMatcher(self.model.vocab)
-        self.__add_ontology_terms()
-
-    def __add_ontology_terms(self):
-        id_to_name = {id_: data.get('name') for id_, data in self.ontology.nodes(data=True)}
-        for node in self.ontology.nodes:
-            if id_to_name[node]:
+        for ontology_path in ontology_paths:
+            # the ontology graph is only needed while its terms are added to the shared matcher
+            ontology = obonet.read_obo(ontology_path)  # ("/home/tr142/Downloads/uberon.obo")
+            name = ontology.graph.get("ontology") or os.path.basename(ontology_path).rsplit(".", 1)[0]
+            self.ontology_names.append(name)
+            self.__add_ontology_terms(ontology, name)
+            for term, key in self.get_simple_term_list(ontology).items():
+                self.term_list.setdefault(term, key)
+        self.priorities = priorities if priorities else {name: i for i, name in enumerate(self.ontology_names)}
+
+    def __add_ontology_terms(self, ontology, ontology_name):
+        id_to_name = {id_: data.get('name') for id_, data in ontology.nodes(data=True)}
+        for node in ontology.nodes:
+            if id_to_name[node] and node not in self.term_ontology:
+                self.term_ontology[node] = ontology_name
                 patterns = []
                 patterns.extend(get_term_variations(id_to_name[node]))
-                if "synonym" in self.ontology.nodes[node].keys():
-                    for syn in self.ontology.nodes[node]["synonym"]:
+                if "synonym" in ontology.nodes[node].keys():
+                    for syn in ontology.nodes[node]["synonym"]:
                         patterns.extend(get_term_variations(syn[1:syn.find("\"", 1)]))
                 patterns = self.model.tokenizer.pipe(patterns)
                 self.term_matcher.add(node, patterns, on_match=self.__on_match)
 
-    def get_simple_term_list(self):
+    @staticmethod
+    def get_simple_term_list(ontology):
         terms = {}
-        for key, data in self.ontology.nodes(data=True):
+        for key, data in ontology.nodes(data=True):
             if "name" not in data.keys():
                 continue
             terms[data["name"]] = key
@@ -64,6 +145,15 @@ class SpacyModel:
                 terms[syn[1:syn.find("\"", 1)]] = key
         return terms
 
+    def get_ontology(self, term_id):
+        return self.term_ontology.get(term_id, "")
+
+    def get_rank(self, term_id):
+        """
+        Priority of the ontology a term comes from (lower wins on overlapping matches).
+        """
+        return self.priorities.get(self.get_ontology(term_id), len(self.priorities))
+
     def set_abbreviations(self, abbrevs):
         result = []
         self.abbreviation_matcher = PhraseMatcher(self.model.vocab)
@@ -100,6 +190,11 @@ class SpacyModel:
                     if not entity.label_.isnumeric() and ent.label_.isnumeric():
                         entities_to_replace.append(ent)
                         continue
+                    if self.get_rank(ent.label_) < self.get_rank(entity.label_):
+                        return
+                    if self.get_rank(ent.label_) > self.get_rank(entity.label_):
+                        entities_to_replace.append(ent)
+                        continue
                     if len(ent) < len(entity):
                         entities_to_replace.append(ent)
             if entities_to_replace:
@@ -107,12 +202,43 @@ class SpacyModel:
                 doc.ents += (entity,)
             return
 
-    def annotate_text(self, text):
-        annotated_doc = self.model(text)
+    def __match(self, annotated_doc):
+        # all annotation paths (single text, chunks, batches) go through here
         self.term_matcher(annotated_doc)
         #self.abbreviation_matcher(annotated_doc)
         return annotated_doc
 
+    def annotate_text(self, text):
+        return self.__match(self.model(text))
+
+    def get_entities(self, text):
+        """
+        Annotate text, splitting it into overlapping chunks if it exceeds the size budget.
+        @param text: text to annotate
+        @return: list of (text, label, start_char, end_char) tuples with offsets relative to text
+        """
+        if len(text) <= self.max_chunk_size:
+            return [(x.text, x.label_, x.start_char, x.end_char) for x in self.annotate_text(text).ents]
+        spans = split_text(text, self.max_chunk_size, self.chunk_overlap)
+        entities = []
+        # only one chunk is processed (and held in memory) at a time
+        for start, end in spans:
+            chunk_doc = self.annotate_text(text[start:end])
+            entities += [(x.text, x.label_, start + x.start_char, start + x.end_char) for x in chunk_doc.ents]
+        return merge_entities(entities, self.get_rank)
+
+    def pipe_entities(self, texts, batch_size=256):
+        """
+        Annotate a stream of short texts (e.g. table cells) in batches.
+        Texts must not exceed the size budget (max_chunk_size), use split_text for longer ones.
+        @param texts: iterable of texts
+        @param batch_size: number of texts processed by spaCy per batch
+        @return: generator yielding a list of (text, label, start_char, end_char) tuples per text
+        """
+        for doc in self.model.pipe(texts, batch_size=batch_size):
+            self.__match(doc)
+            yield [(x.text, x.label_, x.start_char, x.end_char) for x in doc.ents]
+
 
 def remove_comma_variation(term: str):
     if "," in term:
@@ -243,42 +369,77 @@ def get_hyphenated_variations(term: str):
     return output
 
 
-def main(ontology_path, directory):
-    model = SpacyModel(ontology_path)
+def annotate_document(model, doc):
+    """
+    Annotate all passages of a BioC document in place.
+    @param model: SpacyModel used for annotation
+    @param doc: BioC document (dict)
+    @return: the annotated document
+    """
+    full_text = "\n".join([x["text"] for x in doc["passages"]])
+    abbreviations = get_all_abbreviations(full_text)
+    model.set_abbreviations(abbreviations)
+    # for passage in doc["passages"]:
+    for idx_psg in range(len(doc["passages"])):
+        text = doc["passages"][idx_psg]["text"]
+        offset = doc["passages"][idx_psg]["offset"]
+        entities = model.get_entities(text)
+        if entities:
+            print([(x[0], x[1], offset + x[2], offset + x[3]) for x in entities])
+            doc["passages"][idx_psg].setdefault("annotations", [])
+            doc["passages"][idx_psg]["annotations"] += [{
+                "id": str(uuid.uuid4()),
+                "infons": {
+                    "x-ref": label,
+                    "ontology": model.get_ontology(label)
+                },
+                "text": ent_text,
+                "locations": [{
+                    "offset": offset + start,
+                    "length": end - start + 1
+                }]
+            } for ent_text, label, start, end in entities]
+    return doc
+
+
+def annotate_documents(model, docs):
+    """
+    Generator pipeline stage: annotate BioC documents one at a time as they are consumed.
+    """
+    for doc in docs:
+        yield annotate_document(model, doc)
+
+
+def annotate_file(model, filepath, index=None, exporter=None):
+    """
+    Stream the documents of a BioC file through the annotator into a <name>.ann.json collection.
+    @param exporter: optional AnnotationExporter receiving the annotations of the written file as columnar rows
+    @return: path of the annotated output file
+    """
+    fn_out = os.path.basename(filepath).replace(".json", ".ann.json")
+    outfile = os.path.join(os.path.dirname(filepath), fn_out)
+    write_bioc_documents(annotate_documents(model, iter_bioc_documents(filepath)), outfile)
+    # only export and index files that were written completely
+    if index:
+        index.add_file(outfile)
+    if exporter:
+        exporter.add_file(outfile)
+    return outfile
+
+
+def main(ontology_path, directory, index_path=None, max_chunk_size=100000, chunk_overlap=500, export_dir=None,
+         export_batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    @param export_batch_rows: rows per Parquet part file of the columnar export
+    """
+    model = SpacyModel(ontology_path, max_chunk_size, chunk_overlap)
+    index = AnnotationIndex(index_path, ontology_path) if index_path else None
     files = [x for x in os.listdir(directory) if ".json" in x and ".ann." not in x and ".pubann." not in x]
-    # for file in files:
-    for idx_file in range(len(files)):
-        filepath = os.path.join(directory, files[idx_file])
-        study = load_bioc_study(filepath)
-        if "documents" not in study:
-            study = {"documents": [study]}
-        full_text = "\n".join([x["text"] for x in study["documents"][0]["passages"]])
-        abbreviations = get_all_abbreviations(full_text)
-        model.set_abbreviations(abbreviations)
-        for doc in study["documents"]:
-            # for passage in doc["passages"]:
-            for idx_psg in range(len(doc["passages"])):
-                text = doc["passages"][idx_psg]["text"]
-                offset = doc["passages"][idx_psg]["offset"]
-                annotated_text = model.annotate_text(text)
-                if annotated_text.ents:
-                    # import pdb; pdb.set_trace()
-                    print(annotated_text.text_with_ws)
-                    print([(x.text, x.label_, offset + x.start_char, offset + x.end_char) for x in annotated_text.ents])
-                    doc["passages"][idx_psg]["annotations"] += [{
-                        "id": str(uuid.uuid4()),
-                        "infons": {
-                            "x-ref": x.label_
-                        },
-                        "text": x.text,
-                        "locations": [{
-                            "offset": offset + x.start_char,
-                            "length": x.end_char - x.start_char + 1
-                        }]
-                    } for x in annotated_text.ents]
-            fn_out = os.path.basename(filepath).replace(".json", ".ann.json")
-            outfile = os.path.join(filepath.rsplit("/", 1)[0], fn_out)
-            write_bioc_study(doc, outfile)
+    with AnnotationExporter(export_dir, batch_rows=export_batch_rows) if export_dir else nullcontext() as exporter:
+        for file in files:
+            annotate_file(model, os.path.join(directory, file), index, exporter)
+    if index:
+        index.save()
 
     return True
 
@@ -286,9 +447,19 @@ def main(ontology_path, directory):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='PROG')
     parser.add_argument('-d', '--directory', type=str, help="Path to directory containing bioc files for processing")
-    parser.add_argument('-o', '--ontology', type=str,
-                        help="Path or URL to the ontology OBO file")
+    parser.add_argument('-o', '--ontology', type=str, nargs='+',
+                        help="Path(s) or URL(s) to ontology OBO files, in order of priority")
+    parser.add_argument('-i', '--index', type=str, help="Path to the corpus annotation index to update")
+    parser.add_argument('--max-chunk-size', type=int, default=100000,
+                        help="Size budget (characters) per annotation call, longer passages are split into chunks")
+    parser.add_argument('--chunk-overlap', type=int, default=500,
+                        help="Number of characters shared between consecutive chunks")
+    parser.add_argument('-e', '--export_dir', type=str,
+                        help="Append annotations to a columnar (Parquet) dataset in this directory")
+    parser.add_argument('--export-batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                        help="Rows per Parquet part file")
     args = parser.parse_args()
     ontology_path = args.ontology
     directory = args.directory
-    main(ontology_path, directory)
+    main(ontology_path, directory, args.index, args.max_chunk_size, args.chunk_overlap, args.export_dir,
+         args.export_batch_rows)
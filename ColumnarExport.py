@@ -0,0 +1,294 @@
+import argparse
+import os
+import threading
+import time
+import uuid
+
+from Utils import iter_bioc_documents, json_dumps, json_loads
+
+# pyarrow is optional, only needed for the columnar export
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+# bookkeeping of exported documents and files (leading underscore: ignored by Parquet readers)
+MANIFEST_NAME = "_manifest.json"
+
+# rows per Parquet part file, small part files make reading the dataset slow
+DEFAULT_BATCH_ROWS = 50000
+
+COLUMNS = ["pmcid", "passage", "passage_offset", "offset", "end", "text", "ontology_id", "ontology", "annotation_id"]
+
+
+def get_schema():
+    return pa.schema([
+        ("pmcid", pa.string()),
+        ("passage", pa.int32()),
+        ("passage_offset", pa.int64()),
+        ("offset", pa.int64()),
+        ("end", pa.int64()),
+        ("text", pa.string()),
+        ("ontology_id", pa.string()),
+        ("ontology", pa.string()),
+        ("annotation_id", pa.string())
+    ])
+
+
+def get_next_part_number(directory):
+    """
+    Number of the next part file in a batch directory (part files may be missing after compaction).
+    """
+    if not os.path.isdir(directory):
+        return 0
+    numbers = [int(fn[len("part-"):-len(".parquet")]) for fn in os.listdir(directory)
+               if fn.startswith("part-") and fn.endswith(".parquet")]
+    return max(numbers) + 1 if numbers else 0
+
+
+def get_formatted_pmcid(doc_id):
+    doc_id = str(doc_id)
+    return doc_id if doc_id.startswith("PMC") else F"PMC{doc_id}"
+
+
+def iter_annotation_rows(doc):
+    """
+    Flatten the annotations of a BioC document into rows (one per annotation location).
+    Spans use the same (exclusive) end offset as the PubAnnotation export.
+    """
+    pmcid = get_formatted_pmcid(doc.get("id", ""))
+    for idx_psg, passage in enumerate(doc.get("passages", [])):
+        for annotation in passage.get("annotations", []):
+            infons = annotation.get("infons", {})
+            for loc in annotation.get("locations", []):
+                yield {
+                    "pmcid": pmcid,
+                    "passage": idx_psg,
+                    "passage_offset": passage.get("offset", 0),
+                    "offset": loc["offset"],
+                    "end": loc["offset"] + loc["length"] - 1,
+                    "text": annotation.get("text", ""),
+                    "ontology_id": infons.get("x-ref", ""),
+                    "ontology": infons.get("ontology", ""),
+                    "annotation_id": annotation.get("id", "")
+                }
+
+
+class AnnotationExporter:
+    """
+    Append annotations to a Parquet dataset partitioned by batch (<export_dir>/batch=<batch_id>/).
+    Rows are buffered and written as a new part file every batch_rows rows (0: only on flush()/close()), so
+    the dataset can be read (e.g. pandas.read_parquet(export_dir)) while the annotator is still running.
+    Flushing more often makes rows visible earlier at the cost of many small part files, compact() merges them.
+    Exporting a PMCID again replaces its earlier rows: a manifest in export_dir records the part file
+    holding each PMCID, and older part files are rewritten without it. Only one exporter may write to
+    an export_dir at a time.
+    Use as context manager or call close() to write the remaining rows.
+    """
+
+    def __init__(self, export_dir, batch_id=None, batch_rows=DEFAULT_BATCH_ROWS):
+        if pa is None:
+            raise ImportError("pyarrow is required for the columnar export (pip install pyarrow)")
+        self.export_dir = export_dir
+        self.batch_id = batch_id if batch_id else time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.batch_directory = os.path.join(export_dir, F"batch={self.batch_id}")
+        self.batch_rows = batch_rows
+        self.schema = get_schema()
+        self.columns = {col: [] for col in COLUMNS}
+        # PMCIDs added since the last flush (including documents without annotations)
+        self.buffered = set()
+        self.n_rows = 0
+        self.lock = threading.Lock()
+        os.makedirs(export_dir, exist_ok=True)
+        # documents[pmcid] = part file (relative to export_dir), files[path] = mtime of exported BioC files
+        self.manifest_path = os.path.join(export_dir, MANIFEST_NAME)
+        self.documents = {}
+        self.files = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                manifest = json_loads(f.read())
+            self.documents = manifest.get("documents", {})
+            self.files = manifest.get("files", {})
+        self.n_parts = get_next_part_number(self.batch_directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def add_document(self, doc):
+        with self.lock:
+            pmcid = get_formatted_pmcid(doc.get("id", ""))
+            if pmcid in self.buffered:
+                # document added twice before a flush: keep the latest version only
+                keep = [i for i, x in enumerate(self.columns["pmcid"]) if x != pmcid]
+                self.n_rows -= len(self.columns["pmcid"]) - len(keep)
+                self.columns = {col: [values[i] for i in keep] for col, values in self.columns.items()}
+            self.buffered.add(pmcid)
+            for row in iter_annotation_rows(doc):
+                for col in COLUMNS:
+                    self.columns[col].append(row[col])
+                self.n_rows += 1
+            if self.batch_rows and len(self.columns["pmcid"]) >= self.batch_rows:
+                self.__flush()
+
+    def add_file(self, filepath):
+        """
+        Export all documents of an annotated BioC file and record its modification time.
+        """
+        for doc in iter_bioc_documents(filepath):
+            self.add_document(doc)
+        with self.lock:
+            self.files[os.path.abspath(filepath)] = os.path.getmtime(filepath)
+
+    def is_exported(self, filepath):
+        """
+        Check if a file was exported before and has not changed since.
+        """
+        mtime = self.files.get(os.path.abspath(filepath))
+        return mtime is not None and mtime >= os.path.getmtime(filepath)
+
+    def __write_table(self, table, filepath):
+        # write to a temporary (hidden) name first, so readers never see partially written files
+        tmp_path = os.path.join(os.path.dirname(filepath), F"_{os.path.basename(filepath)}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, filepath)
+
+    def __remove_documents(self, pmcids):
+        """
+        Rewrite earlier part files without the rows of the given PMCIDs.
+        """
+        parts = {}
+        for pmcid in pmcids:
+            if pmcid in self.documents:
+                parts.setdefault(self.documents.pop(pmcid), []).append(pmcid)
+        for part, part_pmcids in parts.items():
+            filepath = os.path.join(self.export_dir, part)
+            if not os.path.exists(filepath):
+                continue
+            table = pq.ParquetFile(filepath).read()
+            table = table.filter(pc.invert(pc.is_in(table["pmcid"], value_set=pa.array(part_pmcids))))
+            if table.num_rows:
+                self.__write_table(table, filepath)
+            else:
+                os.remove(filepath)
+                part_dir = os.path.dirname(filepath)
+                if part_dir != self.batch_directory and not os.listdir(part_dir):
+                    os.rmdir(part_dir)
+
+    def __save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json_dumps({"documents": self.documents, "files": self.files}))
+        os.replace(tmp_path, self.manifest_path)
+
+    def __flush(self):
+        # earlier rows of re-exported documents are replaced, even if they have no annotations now
+        self.__remove_documents(self.buffered)
+        if self.columns["pmcid"]:
+            table = pa.Table.from_pydict(self.columns, schema=self.schema)
+            os.makedirs(self.batch_directory, exist_ok=True)
+            fn = F"part-{self.n_parts:05d}.parquet"
+            self.__write_table(table, os.path.join(self.batch_directory, fn))
+            self.n_parts += 1
+            part = os.path.join(F"batch={self.batch_id}", fn)
+            for pmcid in set(self.columns["pmcid"]):
+                self.documents[pmcid] = part
+            self.columns = {col: [] for col in COLUMNS}
+        self.buffered = set()
+        self.__save_manifest()
+
+    def flush(self):
+        with self.lock:
+            self.__flush()
+
+    def close(self):
+        self.flush()
+
+    def compact(self, max_rows=DEFAULT_BATCH_ROWS):
+        """
+        Merge consecutive small part files of every batch into part files of up to max_rows rows.
+        Part files are never split, so the rows of a PMCID stay in a single part file.
+        @return: number of removed part files
+        """
+        with self.lock:
+            self.__flush()
+            n_removed = 0
+            for batch in sorted(os.listdir(self.export_dir)):
+                batch_directory = os.path.join(self.export_dir, batch)
+                if not batch.startswith("batch=") or not os.path.isdir(batch_directory):
+                    continue
+                groups = [[]]
+                n_rows = 0
+                for fn in sorted(fn for fn in os.listdir(batch_directory)
+                                 if fn.startswith("part-") and fn.endswith(".parquet")):
+                    n_part_rows = pq.ParquetFile(os.path.join(batch_directory, fn)).metadata.num_rows
+                    if groups[-1] and n_rows + n_part_rows > max_rows:
+                        groups.append([])
+                        n_rows = 0
+                    groups[-1].append(fn)
+                    n_rows += n_part_rows
+                n_next = get_next_part_number(batch_directory)
+                for group in groups:
+                    if len(group) < 2:
+                        continue
+                    table = pa.concat_tables([pq.ParquetFile(os.path.join(batch_directory, fn)).read()
+                                              for fn in group])
+                    fn_out = F"part-{n_next:05d}.parquet"
+                    n_next += 1
+                    self.__write_table(table, os.path.join(batch_directory, fn_out))
+                    # point the manifest to the merged file before removing the old ones
+                    old_parts = {os.path.join(batch, fn) for fn in group}
+                    for pmcid, part in self.documents.items():
+                        if part in old_parts:
+                            self.documents[pmcid] = os.path.join(batch, fn_out)
+                    self.__save_manifest()
+                    for fn in group:
+                        os.remove(os.path.join(batch_directory, fn))
+                    n_removed += len(group) - 1
+            self.n_parts = get_next_part_number(self.batch_directory)
+            return n_removed
+
+
+def export_corpus(directory, export_dir, batch_id=None, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    Export annotated BioC files (.ann.json) below a directory that are new or changed since the last export.
+    @return: number of exported annotation rows
+    """
+    with AnnotationExporter(export_dir, batch_id, batch_rows) as exporter:
+        for root, _, files in os.walk(directory):
+            for fn in sorted(files):
+                filepath = os.path.join(root, fn)
+                if fn.endswith(".ann.json") and not exporter.is_exported(filepath):
+                    exporter.add_file(filepath)
+    return exporter.n_rows
+
+
+def load_annotations(export_dir, columns=None):
+    """
+    Load the exported annotations of all batches into a pandas DataFrame.
+    """
+    import pandas as pd
+    return pd.read_parquet(export_dir, columns=columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-d', '--directory', type=str, required=True,
+                        help="Directory containing annotated BioC files (.ann.json)")
+    parser.add_argument('-O', '--out_directory', type=str, required=True, help="Parquet dataset directory")
+    parser.add_argument('-b', '--batch', type=str, help="Batch ID (default: timestamp)")
+    parser.add_argument('-r', '--batch_rows', type=int, default=DEFAULT_BATCH_ROWS, help="Rows per Parquet part file")
+    parser.add_argument('--compact', action='store_true',
+                        help="Merge small part files (e.g. of earlier exports) into files of up to batch_rows rows")
+    args = parser.parse_args()
+    print(F"Exported {export_corpus(args.directory, args.out_directory, args.batch, args.batch_rows)} annotation(s)")
+    if args.compact:
+        with AnnotationExporter(args.out_directory, args.batch, args.batch_rows) as exporter:
+            print(F"Removed {exporter.compact(args.batch_rows)} part file(s)")
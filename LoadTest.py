@@ -0,0 +1,124 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import SupplementaryDownloader as downloader
+from NcbiStandIn import StandInConfig, start_server, synthesize_recordings
+
+TARGETS = ["get_supp_docs", "download_PMC_BioC", "download_doc_pmc_id"]
+
+
+def call_target(target, pmc_id, out_directory):
+    """
+    Run one downloader call for a PMCID.
+    @return: True if the call succeeded
+    """
+    dir_out = os.path.join(out_directory, target, pmc_id)
+    os.makedirs(dir_out, exist_ok=True)
+    if target == "get_supp_docs":
+        return bool(downloader.get_supp_docs(dir_out, pmc_id, False, True))
+    if target == "download_PMC_BioC":
+        downloader.download_PMC_BioC(pmc_id, "json", dir_out)
+        return os.path.exists(os.path.join(dir_out, F"{pmc_id}.json"))
+    return bool(downloader.download_doc_pmc_id(pmc_id, dir_out))
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def run_load_test(target, pmc_ids, out_directory, concurrency=4):
+    """
+    Drive a downloader function for all PMCIDs with the given concurrency.
+    @return: dict with throughput, latency percentiles and request/retry counts
+    """
+    stats_before = dict(downloader.request_stats)
+
+    def timed_call(pmc_id):
+        start = time.perf_counter()
+        try:
+            ok = call_target(target, pmc_id, out_directory)
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, pmc_ids))
+    elapsed = time.perf_counter() - start
+    latencies = [x[1] for x in results]
+    report = {
+        "target": target,
+        "calls": len(results),
+        "failed": sum(1 for ok, _ in results if not ok),
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(results) / elapsed if elapsed else 0.0,
+        "p50_s": get_percentile(latencies, 50),
+        "p95_s": get_percentile(latencies, 95),
+        "p99_s": get_percentile(latencies, 99),
+        "max_s": max(latencies, default=0.0)
+    }
+    for key in downloader.request_stats:
+        report[F"http_{key}"] = downloader.request_stats[key] - stats_before[key]
+    return report
+
+
+def print_report(report, server_stats):
+    print(F"== {report['target']}")
+    print(F"calls: {report['calls']} ({report['failed']} failed) in {report['elapsed_s']:.2f}s"
+          F" -> {report['throughput_per_s']:.2f} calls/s")
+    print(F"latency: p50 {report['p50_s']:.3f}s, p95 {report['p95_s']:.3f}s,"
+          F" p99 {report['p99_s']:.3f}s, max {report['max_s']:.3f}s")
+    print(F"HTTP requests: {report['http_requests']}, retries: {report['http_retries']},"
+          F" failed after retries: {report['http_failures']}")
+    print("server: " + ", ".join(F"{key} {value}" for key, value in server_stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-r', '--recordings', type=str,
+                        help="Directory containing recorded responses (default: synthetic recordings)")
+    parser.add_argument('-n', '--n_articles', type=int, default=20, help="Number of synthetic articles")
+    parser.add_argument('-t', '--target', type=str, choices=TARGETS, nargs='+', default=TARGETS,
+                        help="Downloader function(s) to drive")
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help="Number of concurrent calls")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mean server response delay (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Maximum deviation from the mean delay (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument('--throttle', type=int, default=0, help="Maximum requests per second (0: no limit)")
+    parser.add_argument('--delay', type=float, nargs=2, default=[0, 0], metavar=("LOWER", "UPPER"),
+                        help="Downloader politeness delay range (seconds)")
+    parser.add_argument('--retries', type=int, default=downloader.max_retries, help="Downloader retries per request")
+    parser.add_argument('--backoff', type=float, default=0.1, help="Downloader retry backoff (seconds)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        recordings = args.recordings
+        if recordings:
+            pmc_ids = sorted(fn.rsplit(".", 1)[0] for fn in os.listdir(os.path.join(recordings, "articles")))
+        else:
+            recordings = os.path.join(tmp_dir, "recordings")
+            pmc_ids = synthesize_recordings(recordings, args.n_articles)
+        server = start_server(recordings, config=StandInConfig(args.latency, args.jitter, args.error_rate,
+                                                               args.throttle))
+        downloader.ncbi_base_url = server.base_url
+        downloader.delay_range = tuple(args.delay)
+        downloader.max_retries = args.retries
+        downloader.retry_backoff = args.backoff
+        try:
+            for target in args.target:
+                server_stats_before = dict(server.stats)
+                report = run_load_test(target, pmc_ids, os.path.join(tmp_dir, "out"), args.concurrency)
+                print_report(report, {key: server.stats[key] - server_stats_before[key] for key in server.stats})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Utils import json_dumps
+
+# routes of the NCBI endpoints used by SupplementaryDownloader
+RE_BIOC = re.compile(r"^/research/bionlp/RESTful/pmcoa\.cgi/BioC_(\w+)/(PMC\d+)/unicode/?$")
+RE_SUPPLEMENTARY = re.compile(r"^/pmc/articles/(PMC\d+)/bin/([^/]+)$")
+RE_ARTICLE = re.compile(r"^/pmc/articles/(PMC\d+)/?$")
+
+CONTENT_TYPES = {"html": "text/html", "json": "application/json", "xml": "application/xml",
+                 "csv": "text/csv", "tsv": "text/tab-separated-values", "txt": "text/plain"}
+
+
+class StandInConfig:
+    """
+    Behaviour of the stand-in server (can be changed while it is running).
+    @param latency: mean delay (seconds) before a response is sent
+    @param latency_jitter: maximum random deviation from the mean delay (seconds)
+    @param error_rate: fraction of requests answered with a 500 error
+    @param throttle_rps: maximum number of requests per second, requests above are answered with 429 (0: no limit)
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, throttle_rps=0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded responses from a directory:
+        articles/<PMCID>.html                 -> /pmc/articles/<PMCID>
+        supplementary/<PMCID>/<filename>      -> /pmc/articles/<PMCID>/bin/<filename>
+        bioc/<PMCID>.<format>                 -> /research/bionlp/RESTful/pmcoa.cgi/BioC_<format>/<PMCID>/unicode
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        config = server.config
+        if config.throttle_rps and not server.acquire_slot():
+            server.count("throttled")
+            self.__send(429, b"Too Many Requests", extra_headers={"Retry-After": "1"})
+            return
+        delay = config.latency + random.uniform(-config.latency_jitter, config.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < config.error_rate:
+            server.count("errors")
+            self.__send(500, b"Internal Server Error")
+            return
+        filepath = self.__resolve(self.path.split("?", 1)[0])
+        if not filepath or not os.path.isfile(filepath):
+            server.count("not_found")
+            self.__send(404, b"Not Found")
+            return
+        with open(filepath, "rb") as f:
+            body = f.read()
+        server.count("ok")
+        self.__send(200, body, CONTENT_TYPES.get(filepath.rsplit(".", 1)[-1], "application/octet-stream"))
+
+    def __resolve(self, path):
+        recordings = self.server.recordings
+        match = RE_BIOC.match(path)
+        if match:
+            return os.path.join(recordings, "bioc", F"{match.group(2)}.{match.group(1)}")
+        match = RE_SUPPLEMENTARY.match(path)
+        if match:
+            return os.path.join(recordings, "supplementary", match.group(1), os.path.basename(match.group(2)))
+        match = RE_ARTICLE.match(path)
+        if match:
+            return os.path.join(recordings, "articles", F"{match.group(1)}.html")
+        return None
+
+    def __send(self, status, body, content_type="text/plain", extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, recordings, config=None):
+        super().__init__(address, StandInHandler)
+        self.recordings = recordings
+        self.config = config if config else StandInConfig()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "not_found": 0}
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    @property
+    def base_url(self):
+        return F"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def acquire_slot(self):
+        """
+        Fixed one-second window rate limit.
+        @return: True if the request is within the configured rate
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            return self.window_count <= self.config.throttle_rps
+
+
+def start_server(recordings, host="127.0.0.1", port=0, config=None):
+    """
+    Start the stand-in server in a background thread (port 0 picks a free port).
+    @return: the running StandInServer, stop it with shutdown()
+    """
+    server = StandInServer((host, port), recordings, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthesize_recordings(recordings, n_articles=10, n_supplementary=2, supplementary_rows=1000, first_id=1000000):
+    """
+    Create synthetic recordings (article pages, CSV supplements, BioC JSON) for offline testing.
+    @return: list of PMCIDs
+    """
+    pmc_ids = [F"PMC{first_id + i}" for i in range(n_articles)]
+    for sub_dir in ["articles", "supplementary", "bioc"]:
+        os.makedirs(os.path.join(recordings, sub_dir), exist_ok=True)
+    for pmc_id in pmc_ids:
+        fn_supps = [F"{pmc_id}_S{i + 1}.csv" for i in range(n_supplementary)]
+        links = "".join(F'<a href="/pmc/articles/{pmc_id}/bin/{fn}">{fn}</a>' for fn in fn_supps)
+        with open(os.path.join(recordings, "articles", F"{pmc_id}.html"), "wt") as f:
+            f.write(F'<html><body><h1>{pmc_id}</h1><div id="data-suppmats">{links}</div></body></html>')
+        os.makedirs(os.path.join(recordings, "supplementary", pmc_id), exist_ok=True)
+        for fn in fn_supps:
+            with open(os.path.join(recordings, "supplementary", pmc_id, fn), "wt") as f:
+                f.write("gene,tissue,expression\n")
+                f.writelines(F"GENE{i},liver,{i % 100}\n" for i in range(supplementary_rows))
+        text = "Expression in the liver and the heart."
+        with open(os.path.join(recordings, "bioc", F"{pmc_id}.json"), "wt") as f:
+            f.write(json_dumps([{"source": "PMC", "date": "", "key": "", "infons": {}, "documents": [{
+                "id": pmc_id[3:],
+                "infons": {},
+                "passages": [{"offset": 0, "infons": {"section_type": "TITLE"}, "text": text,
+                              "annotations": [], "relations": []}],
+                "relations": []
+            }]}]))
+    return pmc_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-r', '--recordings', type=str, required=True, help="Directory containing recorded responses")
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean response delay (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum deviation from the mean delay (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument('--throttle', type=int, default=0, help="Maximum requests per second (0: no limit)")
+    parser.add_argument('--synthesize', type=int, default=0,
+                        help="Create this many synthetic articles in the recordings directory first")
+    args = parser.parse_args()
+    if args.synthesize:
+        synthesize_recordings(args.recordings, args.synthesize)
+    server = StandInServer((args.host, args.port), args.recordings,
+                           StandInConfig(args.latency, args.jitter, args.error_rate, args.throttle))
+    print(F"Serving {args.recordings} on {server.base_url} (set NCBI_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,231 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from Annotator import SpacyModel, annotate_file
+from AnnotationIndex import AnnotationIndex
+from ColumnarExport import DEFAULT_BATCH_ROWS, AnnotationExporter
+from SupplementaryDownloader import download_PMC_BioC, get_supp_docs
+from bioc2pubannotation import bioc2pubanno
+
+# marks the end of the input stream of a stage
+STOP = object()
+
+# model of an annotation worker process
+worker_model = None
+
+
+def init_annotation_worker(ontology_path, max_chunk_size, chunk_overlap):
+    global worker_model
+    worker_model = SpacyModel(ontology_path, max_chunk_size, chunk_overlap)
+
+
+def annotate_in_worker(fn_bioc):
+    return annotate_file(worker_model, fn_bioc)
+
+
+class Stage:
+    """
+    Pipeline stage: a pool of worker threads consuming items from a bounded input queue.
+    Results (other than None) are passed on to the next stage. Once all workers of a stage are done,
+    the next stage (and any side stages func feeds directly) is told to stop, so documents flow
+    through the pipeline as soon as they are ready.
+    """
+
+    def __init__(self, name, func, n_workers=1, queue_size=8, next_stage=None, side_stages=None):
+        self.name = name
+        self.func = func
+        self.n_workers = n_workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = next_stage
+        self.side_stages = side_stages if side_stages else []
+        self.n_running = n_workers
+        self.n_processed = 0
+        self.n_failed = 0
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.__work, name=F"{self.name}-{i}", daemon=True)
+                        for i in range(self.n_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def stop(self):
+        for _ in range(self.n_workers):
+            self.queue.put(STOP)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def __work(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                break
+            try:
+                result = self.func(item)
+                with self.lock:
+                    self.n_processed += 1
+            except Exception as ex:
+                logging.error(F"{self.name} failed for {item}:\n{ex}")
+                with self.lock:
+                    self.n_failed += 1
+                continue
+            if result is not None and self.next_stage:
+                self.next_stage.put(result)
+        with self.lock:
+            self.n_running -= 1
+            is_last = self.n_running == 0
+        if is_last:
+            for stage in [self.next_stage] + self.side_stages:
+                if stage:
+                    stage.stop()
+
+
+class AnnotationPipeline:
+    """
+    End-to-end pipeline: fetch (BioC) -> BioC to PubAnnotation conversion -> annotation ->
+    export of annotated PubAnnotation files (and index update). Supplementary files are downloaded
+    by a separate stage fed by fetch, so their politeness delays do not hold up the next BioC download.
+    Each stage has its own worker pool, stages are connected by bounded queues.
+    Annotation runs in a pool of processes (spaCy holds the GIL), each process loads its own model,
+    so memory grows with the number of annotation workers.
+    Output for each document goes to <out_directory>/_<PMCID>, the layout used by the cockpit.
+    """
+
+    def __init__(self, ontology_path, out_directory, index_path=None, fetch_workers=2, convert_workers=1,
+                 annotate_workers=1, export_workers=1, queue_size=8, download_supplementary=True,
+                 max_chunk_size=100000, chunk_overlap=500, export_dir=None, supplementary_workers=1,
+                 export_batch_rows=DEFAULT_BATCH_ROWS):
+        self.ontology_path = ontology_path
+        self.out_directory = out_directory
+        self.download_supplementary = download_supplementary
+        self.max_chunk_size = max_chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.index = AnnotationIndex(index_path, ontology_path) if index_path else None
+        self.index_lock = threading.Lock()
+        self.exporter = AnnotationExporter(export_dir, batch_rows=export_batch_rows) if export_dir else None
+        self.annotate_workers = annotate_workers
+        self.pool = None
+        self.export = Stage("export", self.export_document, export_workers, queue_size)
+        # each annotate thread waits for one worker process at a time
+        self.annotate = Stage("annotate", self.annotate_document, annotate_workers, queue_size, self.export)
+        self.convert = Stage("convert", self.convert_document, convert_workers, queue_size, self.annotate)
+        # unbounded, so slow supplementary downloads never block fetching BioC files
+        self.supplementary = Stage("supplementary", self.fetch_supplementary, supplementary_workers, 0)
+        self.fetch = Stage("fetch", self.fetch_document, fetch_workers, queue_size, self.convert,
+                           [self.supplementary])
+        self.stages = [self.fetch, self.supplementary, self.convert, self.annotate, self.export]
+
+    def fetch_document(self, pmc_id):
+        path_data = os.path.join(self.out_directory, F"_{pmc_id}")
+        if not os.path.exists(path_data):
+            os.makedirs(path_data)
+        fn_bioc = os.path.join(path_data, F"{pmc_id}.json")
+        if not os.path.exists(fn_bioc):
+            download_PMC_BioC(pmc_id, "json", path_data)
+        if not os.path.exists(fn_bioc):
+            raise IOError(F"BioC download failed: {pmc_id}")
+        if self.download_supplementary:
+            self.supplementary.put((pmc_id, path_data))
+        return fn_bioc
+
+    def fetch_supplementary(self, item):
+        pmc_id, path_data = item
+        get_supp_docs(path_data, pmc_id, False, True)
+        return None
+
+    def convert_document(self, fn_bioc):
+        bioc2pubanno(fn_bioc, fn_bioc.replace(".json", ".pubann.json"))
+        return fn_bioc
+
+    def annotate_document(self, fn_bioc):
+        return self.pool.submit(annotate_in_worker, fn_bioc).result()
+
+    def export_document(self, fn_anno_bioc):
+        bioc2pubanno(fn_anno_bioc, fn_anno_bioc.replace(".ann.json", ".ann.pubann.json"))
+        if self.index:
+            with self.index_lock:
+                self.index.add_file(fn_anno_bioc)
+        if self.exporter:
+            self.exporter.add_file(fn_anno_bioc)
+        return None
+
+    def run(self, pmc_ids):
+        """
+        Process a list of PMCIDs, blocking until all documents have passed through the pipeline.
+        @return: dict mapping stage names to (processed, failed) counts
+        """
+        # spawn (not fork) worker processes, the pipeline threads are already running
+        self.pool = ProcessPoolExecutor(self.annotate_workers, multiprocessing.get_context("spawn"),
+                                        init_annotation_worker,
+                                        (self.ontology_path, self.max_chunk_size, self.chunk_overlap))
+        for stage in self.stages:
+            stage.start()
+        for pmc_id in pmc_ids:
+            pmc_id = pmc_id.strip()
+            if pmc_id:
+                self.fetch.put(pmc_id)
+        self.fetch.stop()
+        try:
+            for stage in self.stages:
+                stage.join()
+        finally:
+            self.pool.shutdown()
+            if self.exporter:
+                self.exporter.close()
+            # keep the index updates of an interrupted or failed run
+            if self.index:
+                with self.index_lock:
+                    self.index.save()
+        return {stage.name: (stage.n_processed, stage.n_failed) for stage in self.stages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-f', '--input_file', type=str, help="path to file containing PMC ids, one id per line")
+    parser.add_argument('-l', '--input_list', type=str, help="list of comma separated PMC ids")
+    parser.add_argument('-d', '--directory', type=str, default=".", help="Output directory")
+    parser.add_argument('-o', '--ontology', type=str, nargs='+',
+                        help="Path(s) or URL(s) to ontology OBO files, in order of priority")
+    parser.add_argument('-i', '--index', type=str, help="Path to the corpus annotation index to update")
+    parser.add_argument('--fetch-workers', type=int, default=2, help="Number of concurrent downloads")
+    parser.add_argument('--convert-workers', type=int, default=1, help="Number of BioC conversion workers")
+    parser.add_argument('--annotate-workers', type=int, default=1,
+                        help="Number of annotation worker processes (each loads its own model)")
+    parser.add_argument('--supplementary-workers', type=int, default=1,
+                        help="Number of concurrent supplementary file downloads")
+    parser.add_argument('--export-workers', type=int, default=1, help="Number of export workers")
+    parser.add_argument('--queue-size', type=int, default=8, help="Maximum number of documents waiting per stage")
+    parser.add_argument('--no-supplementary', action='store_true', help="Do not download supplementary files")
+    parser.add_argument('--max-chunk-size', type=int, default=100000,
+                        help="Size budget (characters) per annotation call, longer passages are split into chunks")
+    parser.add_argument('--chunk-overlap', type=int, default=500,
+                        help="Number of characters shared between consecutive chunks")
+    parser.add_argument('-e', '--export_dir', type=str,
+                        help="Append annotations to a columnar (Parquet) dataset in this directory")
+    parser.add_argument('--export-batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                        help="Rows per Parquet part file")
+    args = parser.parse_args()
+    pmc_ids = []
+    if args.input_file:
+        with open(args.input_file, "r") as in_file:
+            pmc_ids += [line.strip() for line in in_file]
+    if args.input_list:
+        pmc_ids += args.input_list.split(",")
+    pipeline = AnnotationPipeline(args.ontology, args.directory, args.index, args.fetch_workers,
+                                  args.convert_workers, args.annotate_workers, args.export_workers,
+                                  args.queue_size, not args.no_supplementary, args.max_chunk_size,
+                                  args.chunk_overlap, export_dir=args.export_dir, supplementary_workers=args.supplementary_workers,
+                                  export_batch_rows=args.export_batch_rows)
+    for name, (n_processed, n_failed) in pipeline.run(pmc_ids).items():
+        print(F"{name}: {n_processed} processed, {n_failed} failed")
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import itertools
+import os
+import sys
+
+from Annotator import SpacyModel, merge_entities, split_text
+from Utils import json_dumps
+
+# xlsx support is optional
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+TABLE_DELIMITERS = {"csv": ",", "tsv": "\t", "tab": "\t"}
+XLSX_EXTENSIONS = ["xlsx", "xlsm"]
+TEXT_EXTENSIONS = ["txt", "text"]
+
+
+def is_annotatable(value):
+    """
+    Check if a cell value contains text worth annotating (skip empty and purely numeric cells).
+    """
+    return isinstance(value, str) and any(c.isalpha() for c in value)
+
+
+def iter_table_cells(filepath, delimiter):
+    """
+    Stream the cells of a delimited text table row by row.
+    @return: generator of (sheet, row, column, header, text) tuples
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(filepath, "rt", encoding="utf-8", errors="replace", newline="") as fin:
+        header = []
+        for idx_row, row in enumerate(csv.reader(fin, delimiter=delimiter)):
+            if idx_row == 0:
+                header = row
+            for idx_col, value in enumerate(row):
+                if is_annotatable(value):
+                    yield "", idx_row, idx_col, header[idx_col] if idx_col < len(header) else "", value
+
+
+def iter_xlsx_cells(filepath):
+    """
+    Stream the cells of all sheets of an Excel workbook (read-only mode, rows are not kept in memory).
+    @return: generator of (sheet, row, column, header, text) tuples
+    """
+    if openpyxl is None:
+        print(F"openpyxl not installed, skipping: {filepath}")
+        return
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            header = []
+            for idx_row, row in enumerate(sheet.iter_rows(values_only=True)):
+                if idx_row == 0:
+                    header = [str(x) if x is not None else "" for x in row]
+                for idx_col, value in enumerate(row):
+                    if is_annotatable(value):
+                        yield sheet.title, idx_row, idx_col, header[idx_col] if idx_col < len(header) else "", value
+    finally:
+        workbook.close()
+
+
+def iter_text_lines(filepath):
+    """
+    Stream the lines of a plain text file.
+    @return: generator of (sheet, row, column, header, text) tuples
+    """
+    with open(filepath, "rt", encoding="utf-8", errors="replace") as fin:
+        for idx_line, line in enumerate(fin):
+            if is_annotatable(line):
+                yield "", idx_line, 0, "", line.rstrip("\n")
+
+
+def is_supported(filepath):
+    ext = filepath.rsplit(".", 1)[-1].lower()
+    return ext in TABLE_DELIMITERS or ext in XLSX_EXTENSIONS or ext in TEXT_EXTENSIONS
+
+
+def iter_supplementary_cells(filepath):
+    """
+    Select a streaming reader based on the file extension.
+    @return: generator of (sheet, row, column, header, text) tuples, or None if the file type is not supported
+    """
+    ext = filepath.rsplit(".", 1)[-1].lower()
+    if ext in TABLE_DELIMITERS:
+        return iter_table_cells(filepath, TABLE_DELIMITERS[ext])
+    if ext in XLSX_EXTENSIONS:
+        return iter_xlsx_cells(filepath)
+    if ext in TEXT_EXTENSIONS:
+        return iter_text_lines(filepath)
+    return None
+
+
+def annotate_cells(model, cells, batch_size=256):
+    """
+    Annotate a stream of cells in batches, only one batch is held in memory at a time.
+    @param model: SpacyModel used for annotation
+    @param cells: iterable of (sheet, row, column, header, text) tuples
+    @param batch_size: number of cells per batch
+    @return: generator of annotation records (dicts) addressed by sheet/row/column
+    """
+    cells = iter(cells)
+    while True:
+        batch = list(itertools.islice(cells, batch_size))
+        if not batch:
+            return
+        # cells exceeding the size budget are split into chunks, which are merged again below
+        pieces = [(idx_cell, start, cell[4][start:end])
+                  for idx_cell, cell in enumerate(batch)
+                  for start, end in split_text(cell[4], model.max_chunk_size, model.chunk_overlap)]
+        entities = [[] for _ in batch]
+        for (idx_cell, start, _), ents in zip(pieces, model.pipe_entities((p[2] for p in pieces), batch_size)):
+            entities[idx_cell] += [(text, label, start + begin, start + end) for text, label, begin, end in ents]
+        for (sheet, row, col, header, _), ents in zip(batch, entities):
+            for text, label, begin, end in merge_entities(ents, model.get_rank):
+                yield {
+                    "sheet": sheet,
+                    "row": row,
+                    "column": col,
+                    "header": header,
+                    "text": text,
+                    "x-ref": label,
+                    "ontology": model.get_ontology(label),
+                    "begin": begin,
+                    "end": end
+                }
+
+
+def annotate_supplementary_file(model, filepath, outfile, batch_size=256):
+    """
+    Annotate a tabular or text supplementary file, writing one JSON record per line (.ann.jsonl).
+    @return: number of annotations written, or None if the file type is not supported
+    """
+    cells = iter_supplementary_cells(filepath)
+    if cells is None:
+        return None
+    n_annotations = 0
+    with open(outfile, "wt", encoding="utf-8") as fout:
+        for record in annotate_cells(model, cells, batch_size):
+            fout.write(json_dumps(record) + "\n")
+            n_annotations += 1
+    return n_annotations
+
+
+def main(ontology_path, directory, out_directory=None, batch_size=256):
+    """
+    Annotate all supported supplementary files in a directory.
+    @param ontology_path: path (or list of paths) to ontology OBO files
+    @param directory: directory containing supplementary files (<PMCID>_supplementary)
+    @param out_directory: output directory (default: <directory>_annotations)
+    @return: dict mapping file names to number of annotations
+    """
+    out_directory = out_directory if out_directory else directory.rstrip("/") + "_annotations"
+    files = sorted(x for x in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, x)) and is_supported(x))
+    if not files:
+        return {}
+    if not os.path.exists(out_directory):
+        os.mkdir(out_directory)
+    model = SpacyModel(ontology_path)
+    result = {}
+    for fn in files:
+        outfile = os.path.join(out_directory, F"{fn}.ann.jsonl")
+        result[fn] = annotate_supplementary_file(model, os.path.join(directory, fn), outfile, batch_size)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PROG')
+    parser.add_argument('-d', '--directory', type=str, help="Path to directory containing supplementary files")
+    parser.add_argument('-o', '--ontology', type=str, nargs='+',
+                        help="Path(s) or URL(s) to ontology OBO files, in order of priority")
+    parser.add_argument('-O', '--out_directory', type=str, help="Output directory for annotations")
+    parser.add_argument('-b', '--batch_size', type=int, default=256, help="Number of cells annotated per batch")
+    args = parser.parse_args()
+    for fn, n in main(args.ontology, args.directory, args.out_directory, args.batch_size).items():
+        print(F"{fn}: {n} annotation(s)")
@@ -8,6 +8,7 @@ from bioc import biocjson
 from lxml import etree
 import logging
 import argparse
+import threading
 
 logging.basicConfig(filename="SuppDownloader.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %("
                                                                                "message)s")
@@ -21,12 +22,54 @@ no_supp_links = []
 bioc_failed = []
 headers = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:101.0) Gecko/20100101 Firefox/101.0"}
 
+# NCBI endpoint (can be pointed to a local stand-in server, see NcbiStandIn.py)
+ncbi_base_url = os.environ.get("NCBI_BASE_URL", "https://www.ncbi.nlm.nih.gov")
+# politeness delay before each request (seconds)
+delay_range = (4, 10)
+# retries for connection errors and throttled (429) or failed (5xx) responses
+max_retries = 2
+retry_backoff = 2
+request_stats = {"requests": 0, "retries": 0, "failures": 0}
+stats_lock = threading.Lock()
+
+
+def count_request(key):
+    with stats_lock:
+        request_stats[key] += 1
+
+
+def http_get(url, **kwargs):
+    """
+    GET request with retries (exponential backoff, honouring Retry-After) on connection errors,
+    throttling (429) and server errors (5xx).
+    @return: the last response; raises the last connection error if all attempts failed to connect
+    """
+    for attempt in range(max_retries + 1):
+        if attempt:
+            count_request("retries")
+        count_request("requests")
+        try:
+            response = requests.get(url, headers=headers, **kwargs)
+        except requests.ConnectionError:
+            if attempt == max_retries:
+                count_request("failures")
+                raise
+            sleep(retry_backoff * 2 ** attempt)
+            continue
+        if response.status_code != 429 and response.status_code < 500:
+            return response
+        if attempt == max_retries:
+            count_request("failures")
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        sleep(float(retry_after) if retry_after.isdigit() else retry_backoff * 2 ** attempt)
+
 
 def get_article_links(pmc_id):
     random_delay()
     response = None
     try:
-        response = requests.get(F"https://www.ncbi.nlm.nih.gov/pmc/articles/{pmc_id}", headers=headers)
+        response = http_get(F"{ncbi_base_url}/pmc/articles/{pmc_id}")
     except requests.ConnectionError as ce:
         logging.error(F"{pmc_id} could not be downloaded:\n{ce}")
         missing_html_files.append(F"{pmc_id}")
@@ -46,7 +89,7 @@ def get_formatted_pmcid(bioc_file, is_id=False):
 def download_supplementary_file(link_address, new_dir, pmc_id):
     try:
         random_delay()
-        file_response = requests.get(link_address, headers=headers, stream=True)
+        file_response = http_get(link_address, stream=True)
         if file_response.ok:
             new_file_path = new_dir + "/" + link_address.split("/")[-1].replace(" ", "_")
             with open(new_file_path, "wb") as f_out:
@@ -76,7 +119,7 @@ def download_supplementary_files(supp_links, new_dir, pmc_id):
     for link in supp_links:
         link_address = link.attrib['href']
         if "www." not in link_address and "http" not in link_address:
-            link_address = F"https://www.ncbi.nlm.nih.gov{link.attrib['href']}"
+            link_address = F"{ncbi_base_url}{link.attrib['href']}"
         download_supplementary_file(link_address, new_dir, pmc_id)
 
 
@@ -166,8 +209,8 @@ def download_doc_pmc_id(pmc_id, dir_out, pmc_bioc='json'):
 
 def download_PMC_BioC(pmc_id, pmc_bioc='json', input_directory=False):
     try:
-        response = requests.get(
-            f"https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_{pmc_bioc}/{pmc_id}/unicode")
+        response = http_get(
+            f"{ncbi_base_url}/research/bionlp/RESTful/pmcoa.cgi/BioC_{pmc_bioc}/{pmc_id}/unicode")
         if response.ok:
             if not os.path.exists("BioC") and not input_directory:
                 os.mkdir("BioC")
@@ -186,8 +229,10 @@ def process_file(input_file):
         missing_html_files.append(F"{bioc_file.documents[0].id}")
 
 
-def random_delay(lower=4, upper=10):
-    sleep(random.randint(lower, upper))
+def random_delay(lower=None, upper=None):
+    lower = delay_range[0] if lower is None else lower
+    upper = delay_range[1] if upper is None else upper
+    sleep(random.uniform(lower, upper))
 
 
 def load_file(input_path):
@@ -1,18 +1,137 @@
 import json
+import os
+
+# use faster JSON backends when they are installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    if orjson:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
 
 
 def load_bioc_study(filename):
     bioc_study = None
     try:
-        with open(F"{filename}", "r", encoding="utf-8") as fin:
-            bioc_study = json.loads(fin.read())
+        with open(F"{filename}", "rb") as fin:
+            bioc_study = json_loads(fin.read())
     except IOError:
         print(F"Unable to locate/open file: {filename}")
     return bioc_study
 
 def write_bioc_study(doc, filename):
     try:
-        with open(filename, 'wt') as f:
-            f.write(json.dumps(doc))
+        with open(filename, 'wt', encoding="utf-8") as f:
+            f.write(json_dumps(doc))
     except IOError:
-        print(F"Unable to open file for writing: {filename}")
\ No newline at end of file
+        print(F"Unable to open file for writing: {filename}")
+
+
+def __first_char(filename):
+    with open(filename, "rb") as fin:
+        while True:
+            c = fin.read(1)
+            if not c or not c.isspace():
+                return c
+
+
+def iter_bioc_documents(filename):
+    """
+    Lazily yield the documents of a BioC JSON file, one at a time.
+    Handles a single document, a collection and a list of collections (as returned by the PMC BioC API).
+    With ijson installed, only one document is held in memory at a time.
+    @param filename: path to the BioC JSON file
+    @return: generator of BioC documents (dicts)
+    """
+    if ijson:
+        prefix = "item.documents.item" if __first_char(filename) == b"[" else "documents.item"
+        found = False
+        with open(filename, "rb") as fin:
+            for doc in ijson.items(fin, prefix, use_float=True):
+                found = True
+                yield doc
+        if found or prefix.startswith("item"):
+            return
+    # no "documents" array found (or no ijson): load the whole file
+    study = load_bioc_study(filename)
+    if study is None:
+        return
+    collections = study if isinstance(study, list) else [study]
+    for collection in collections:
+        if "documents" in collection:
+            yield from collection["documents"]
+        else:
+            yield collection
+
+
+def iter_bioc_passages(filename):
+    """
+    Lazily yield the passages of all documents in a BioC JSON file.
+    @param filename: path to the BioC JSON file
+    @return: generator of (document ID, passage index, passage) tuples
+    """
+    for doc in iter_bioc_documents(filename):
+        for idx_psg, passage in enumerate(doc.get("passages", [])):
+            yield doc.get("id"), idx_psg, passage
+
+
+class BioCWriter:
+    """
+    Write documents to a BioC JSON collection incrementally, one document at a time.
+    The collection is written to a temporary file, which only replaces filename if no error occurred.
+    Use as context manager:
+        with BioCWriter(filename) as writer:
+            writer.write_document(doc)
+    """
+
+    def __init__(self, filename, source="", date="", key="", infons=None):
+        self.filename = filename
+        self.header = {"source": source, "date": date, "key": key, "infons": infons or {}}
+        self.n_docs = 0
+        self.fout = None
+
+    def __enter__(self):
+        self.fout = open(self.filename + ".tmp", "wt", encoding="utf-8")
+        self.fout.write(json_dumps(self.header)[:-1] + ',"documents":[')
+        return self
+
+    def write_document(self, doc):
+        if self.n_docs:
+            self.fout.write(",")
+        self.fout.write(json_dumps(doc))
+        self.n_docs += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.fout.write("]}")
+        self.fout.close()
+        if exc_type is None:
+            os.replace(self.filename + ".tmp", self.filename)
+        else:
+            os.remove(self.filename + ".tmp")
+        return False
+
+
+def write_bioc_documents(docs, filename, **header):
+    """
+    Stream documents (e.g. from a generator pipeline) into a BioC JSON collection file.
+    @return: number of documents written
+    """
+    with BioCWriter(filename, **header) as writer:
+        for doc in docs:
+            writer.write_document(doc)
+    return writer.n_docs
@@ -1,16 +1,9 @@
 import os
 import sys
-import json
+from Utils import iter_bioc_documents, json_dumps
 
-def bioc2pubanno(infile, outfile):
-  # read input file (BioC JSON)
-  doc = {}
-  with open(infile, 'rt') as f:
-    doc = json.loads(f.read())
-  if 'documents' in doc:
-    doc = doc['documents'][0]
-
-  doc_out = {
+def doc2pubanno(doc):
+  return {
     'text': '\n'.join([psg['text'] for psg in doc['passages']]),
     'denotations': [{
       'id': a['id'],
@@ -19,11 +12,61 @@ def bioc2pubanno(infile, outfile):
         'end': a['locations'][0]['offset'] + a['locations'][0]['length'] - 1,
       },
       'obj': a['infons']['x-ref'] if 'x-ref' in a['infons'] else a['text'] #'Term'
-    } for p in doc['passages'] for a in p['annotations']]
+    } for p in doc['passages'] for a in p.get('annotations', [])]
   }
 
-  with open(outfile, 'wt') as f:
-    f.write(json.dumps(doc_out))
+def iter_pubanno(docs):
+  # generator pipeline stage: convert BioC documents to PubAnnotation one at a time
+  for doc in docs:
+    yield doc2pubanno(doc)
+
+def doc2pubanno_sections(doc):
+  # split document into sections (consecutive passages sharing a section type)
+  # denotation spans are rebased to the text of their section
+  sections = []
+  for psg in doc['passages']:
+    title = psg.get('infons', {}).get('section_type', '')
+    if not sections or sections[-1]['title'] != title:
+      sections.append({'title': title, 'text': '', 'denotations': []})
+    sec = sections[-1]
+    if sec['text']:
+      sec['text'] += '\n'
+    base = len(sec['text']) - psg['offset']
+    sec['text'] += psg['text']
+    sec['denotations'] += [{
+      'id': a['id'],
+      'span': {
+        'begin': base + a['locations'][0]['offset'],
+        'end': base + a['locations'][0]['offset'] + a['locations'][0]['length'] - 1,
+      },
+      'obj': a['infons']['x-ref'] if 'x-ref' in a['infons'] else a['text']
+    } for a in psg.get('annotations', [])]
+  return sections
+
+def merge_pubanno_sections(sections):
+  # combine a window of sections into a single PubAnnotation document
+  doc_out = {'text': '', 'denotations': []}
+  for sec in sections:
+    if doc_out['text']:
+      doc_out['text'] += '\n'
+    base = len(doc_out['text'])
+    doc_out['text'] += sec['text']
+    doc_out['denotations'] += [dict(d, span={
+      'begin': base + d['span']['begin'],
+      'end': base + d['span']['end']
+    }) for d in sec['denotations']]
+  return doc_out
+
+def bioc2pubanno(infile, outfile):
+  # read first document of input file (BioC JSON)
+  if not os.path.exists(infile):
+    raise FileNotFoundError(f'BioC file does not exist: {infile}')
+  doc_out = next(iter_pubanno(iter_bioc_documents(infile)), None)
+  if doc_out is None:
+    raise ValueError(f'No documents in BioC file: {infile}')
+
+  with open(outfile, 'wt', encoding='utf-8') as f:
+    f.write(json_dumps(doc_out))
 
 
 if __name__ == '__main__':
@@ -36,4 +79,4 @@ if __name__ == '__main__':
   pubanno_file = sys.argv[2]
   assert os.path.exists(bioc_file), f'ERROR: file does not exist: {bioc_file}'
   
-  bioc2pubanno(bioc_file, pubanno_file)
\ No newline at end of file
+  bioc2pubanno(bioc_file, pubanno_file)
@@ -1,14 +1,23 @@
 import streamlit as st
 import streamlit.components.v1 as components
+import itertools
 import os
 import requests
 import pandas as pd
 from SupplementaryDownloader import download_doc_pmc_id
-from bioc2pubannotation import bioc2pubanno
+from bioc2pubannotation import bioc2pubanno, doc2pubanno_sections, merge_pubanno_sections
+from SupplementaryAnnotator import main as annotate_supplementary
+from Utils import iter_bioc_documents, json_dumps, json_loads
 from Annotator import main as annotate
+from AnnotationIndex import AnnotationIndex
 
 # configurable paths
-path_ontology = './data/uberon.obo'
+# ontologies to annotate against, in order of priority for overlapping matches
+paths_ontology = ['./data/uberon.obo']
+path_index = './data/corpus.ann.index.json'
+
+# max. number of supplementary annotations shown per file
+n_suppl_rows = 1000
 
 # toggle rendering of sections
 show_doc = False
@@ -70,7 +79,7 @@ if not is_doc_downloaded:
 
 if is_doc_downloaded:
   # load doc PubAnnotation format
-  with open(fn_pubann, 'rt') as f:
+  with open(fn_pubann, 'rt', encoding='utf-8') as f:
     str_doc = f.read()
   # check for supplementary items
   path_suppl = os.path.join(path_data, f'{id_pmc}_supplementary')
@@ -93,11 +102,55 @@ str_pubanno = str_doc
 # check if document has annotations
 fn_pubann = os.path.join(path_data, f'{id_pmc}.ann.pubann.json')
 if os.path.exists(fn_pubann):
-  with open(fn_pubann, 'rt') as f:
+  with open(fn_pubann, 'rt', encoding='utf-8') as f:
     str_doc_ann = f.read()
   show_doc_anno = True
   str_pubanno = str_doc_ann
 
+# number of document sections loaded per page in the paginated viewer
+n_sections_page = 3
+
+def textae_html(str_doc_pubanno):
+  return f"""
+<meta charset="utf-8" />
+<link rel="stylesheet" href="https://textae.pubannotation.org/lib/css/textae.min.css" />
+<script src="https://textae.pubannotation.org/lib/textae.min.js"></script>
+                  
+<div class="textae-editor">
+  {str_doc_pubanno}
+</div>
+"""
+
+# bounded, as every re-annotation (new mtime) adds new cache entries
+@st.cache_data(max_entries=8)
+def load_sections(fn_bioc, mtime):
+  # mtime is part of the cache key, so sections are rebuilt once the document is annotated
+  doc = next(iter_bioc_documents(fn_bioc), None)
+  # files without documents fall back to the full view
+  return doc2pubanno_sections(doc) if doc else []
+
+@st.cache_data(max_entries=32)
+def render_sections(fn_bioc, mtime, start, end):
+  # rendered fragments are cached per document file and window
+  sections = load_sections(fn_bioc, mtime)
+  return textae_html(json_dumps(merge_pubanno_sections(sections[start:end])))
+
+@st.cache_data
+def summarize_suppl_annotations(fn_ann, mtime):
+  # stream through the annotations, files can be large; cached per file and mtime
+  n_ann = 0
+  set_terms = set()
+  with open(fn_ann, 'rt', encoding='utf-8') as f:
+    for line in f:
+      n_ann += 1
+      set_terms.add(json_loads(line)['x-ref'])
+  return n_ann, len(set_terms)
+
+@st.cache_data
+def load_suppl_annotations(fn_ann, mtime, n_rows):
+  with open(fn_ann, 'rt', encoding='utf-8') as f:
+    return pd.DataFrame([json_loads(line) for line in itertools.islice(f, n_rows)])
+
 if show_doc or show_doc_anno:
   st.write("""
 ## Document
@@ -106,16 +159,35 @@ if show_doc or show_doc_anno:
 
 Viewer showing document content (text only, formatting removed).
 """)
-  #components.iframe('https://textae.pubannotation.org/editor.html?mode=edit')
-  components.html(f"""
-<meta charset="utf-8" />
-<link rel="stylesheet" href="https://textae.pubannotation.org/lib/css/textae.min.css" />
-<script src="https://textae.pubannotation.org/lib/textae.min.js"></script>
-                  
-<div class="textae-editor">
-  {str_pubanno}
-</div>
-""", height=600, scrolling=True)
+  viewer_mode = st.radio('Viewer mode', ['Paginated (by section)', 'Full document'], horizontal=True)
+  fn_anno_bioc = os.path.join(path_data, f'{id_pmc}.ann.json')
+  fn_view = fn_anno_bioc if os.path.exists(fn_anno_bioc) else fn_bioc_json
+  sections = []
+  if viewer_mode != 'Full document' and os.path.exists(fn_view):
+    mtime_view = os.path.getmtime(fn_view)
+    sections = load_sections(fn_view, mtime_view)
+  # documents without passages fall back to the full view
+  if not sections:
+    #components.iframe('https://textae.pubannotation.org/editor.html?mode=edit')
+    components.html(textae_html(str_pubanno), height=600, scrolling=True)
+  else:
+    # (selected start section, first section of the current page), the page moves with
+    # previous/next and is reset when another start section is selected
+    key_page = f'section_page_{id_pmc}'
+    idx_selected = st.selectbox('Start at section', range(len(sections)),
+                                format_func=lambda i: f'{i + 1}. {sections[i]["title"] or "(untitled)"}')
+    if st.session_state.get(key_page, (None, 0))[0] != idx_selected:
+      st.session_state[key_page] = (idx_selected, idx_selected)
+    idx_start = min(st.session_state[key_page][1], len(sections) - 1)
+    idx_end = min(idx_start + n_sections_page, len(sections))
+    st.write(f'Showing sections {idx_start + 1}-{idx_end} of {len(sections)}')
+    components.html(render_sections(fn_view, mtime_view, idx_start, idx_end), height=600, scrolling=True)
+    if idx_start > 0 and st.button('Previous sections'):
+      st.session_state[key_page] = (idx_selected, max(idx_start - n_sections_page, 0))
+      st.rerun()
+    if idx_end < len(sections) and st.button('Next sections'):
+      st.session_state[key_page] = (idx_selected, idx_end)
+      st.rerun()
 
 # check for annotations
 fn_anno = os.path.join(path_data, f'{id_pmc}.ann.pubann.json')
@@ -124,7 +196,7 @@ if os.path.exists(fn_anno):
 if not has_annotations and is_doc_downloaded:
   if st.button('Annotate!'):
     with st.spinner('Annotating document...'):
-      result = annotate(path_ontology, path_data)
+      result = annotate(paths_ontology, path_data, path_index)
     if result:
       fn_anno_bioc = os.path.join(path_data, f'{id_pmc}.ann.json')
       # convert document to PubAnnotator
@@ -144,6 +216,50 @@ List of supplementary files associated with the document.
   #st.table(df_supmat)
   st.markdown(df_supmat.to_html(render_links=True, escape=False), unsafe_allow_html=True)
 
+  # annotation of tabular/text supplements
+  path_suppl_ann = f'{path_suppl}_annotations'
+  if os.path.exists(path_suppl) and st.button('Annotate supplementary files'):
+    with st.spinner('Annotating supplementary files...'):
+      annotate_supplementary(paths_ontology, path_suppl, path_suppl_ann)
+  if os.path.exists(path_suppl_ann):
+    lst_ann_files = sorted(fn for fn in os.listdir(path_suppl_ann) if fn.endswith('.ann.jsonl'))
+    lst_summary = []
+    for fn in lst_ann_files:
+      fn_ann = os.path.join(path_suppl_ann, fn)
+      n_ann, n_terms = summarize_suppl_annotations(fn_ann, os.path.getmtime(fn_ann))
+      lst_summary.append((fn[:-len('.ann.jsonl')], n_ann, n_terms))
+    st.write('Annotations found in supplementary files:')
+    st.dataframe(pd.DataFrame(lst_summary, columns=['filename', 'annotations', 'terms']))
+    if lst_ann_files:
+      fn_show = st.selectbox('Show annotations of', lst_ann_files)
+      fn_ann = os.path.join(path_suppl_ann, fn_show)
+      df_suppl_ann = load_suppl_annotations(fn_ann, os.path.getmtime(fn_ann), n_suppl_rows)
+      st.write(f'First {n_suppl_rows} annotations:')
+      st.dataframe(df_suppl_ann)
+
+
+@st.cache_resource(max_entries=1)
+def load_index(path, mtime):
+  # mtime is part of the cache key, so the index is reloaded after updates (only the latest is kept)
+  return AnnotationIndex(path)
+
+st.write("""
+## Corpus Search
+
+Find annotated documents mentioning an ontology term (e.g. UBERON:0002107).
+""")
+id_term = st.text_input('Ontology term ID', '')
+incl_subterms = st.checkbox('Include subterms (is_a/part_of)', value=True)
+if id_term:
+  if os.path.exists(path_index):
+    index = load_index(path_index, os.path.getmtime(path_index))
+    hits = index.search(id_term.strip(), incl_subterms)
+    df_hits = pd.DataFrame(hits, columns=['document', 'term', 'passage', 'offset', 'length'])
+    st.write(f'{len(df_hits)} annotation(s) in {df_hits["document"].nunique()} document(s)')
+    st.dataframe(df_hits)
+  else:
+    st.write('No corpus index found, annotate a document first.')
+
 
 if not os.path.exists(path_data):
   os.mkdir(path_data)